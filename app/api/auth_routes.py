@@ -22,7 +22,7 @@ from app.services.database import (
     get_user_by_email_password,
     add_to_waitlist
 )
-from app.services.password_auth import verify_password
+from app.services.password_auth import verify_password_async
 from app.services.jwt_auth import (
     create_access_token, 
     create_refresh_token,
@@ -450,7 +450,7 @@ async def password_login(request: PasswordLoginRequest):
             )
         
         # Step 2: Verify password
-        if not verify_password(request.password, user['password_hash']):
+        if not await verify_password_async(request.password, user['password_hash']):
             logger.warning(f"Invalid password for: {request.email}")
             raise HTTPException(
                 status_code=401,
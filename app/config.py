@@ -22,6 +22,9 @@ JWT_SECRET = os.getenv("JWT_SECRET", secrets.token_hex(32))  # Auto-generate if
 JWT_ALGORITHM = "HS256"
 JWT_EXPIRATION_HOURS = int(os.getenv("JWT_EXPIRATION_HOURS", 24 * 7))  # 1 week default
 
+# Password hashing cost (bcrypt log2 rounds); lower only on slow hardware
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+
 # Google Cloud Configuration
 GCP_PROJECT_ID = os.getenv("GCP_PROJECT_ID", "gen-lang-client-0839252651")
 
@@ -50,6 +53,9 @@ MAX_IMAGE_SIZE_BYTES = MAX_IMAGE_SIZE_MB * 1024 * 1024
 # Manim Configuration - Optimized for Starter Tier
 MANIM_QUALITY = os.getenv("MANIM_QUALITY", "qh")  # qh = high quality (1080p60fps) for Starter tier
 MANIM_TIMEOUT = int(os.getenv("MANIM_TIMEOUT", 180))  # 3 minutes - Starter CPU is 2x faster
+MANIM_CACHE_DIR = BASE_DIR / os.getenv("MANIM_CACHE_DIR", "temp/manim_cache")  # Tex/Text renders shared across jobs
+MANIM_GPU = os.getenv("MANIM_GPU", "false").lower() == "true"  # OpenGL renderer (needs GPU/GL); falls back to Cairo
+MANIM_WORKERS = int(os.getenv("MANIM_WORKERS", 0))  # >0 = render in a pool of warm manim processes instead of the CLI
 
 # User Configuration
 DEFAULT_ASK_DOUBT_CREDITS = int(os.getenv("DEFAULT_ASK_DOUBT_CREDITS", 3))
@@ -19,6 +19,7 @@ from app.api.auth_routes import router as auth_router
 from app.api.admin_routes import router as admin_router
 from app.services.database import create_admin, get_user_by_email
 from app.services.password_auth import hash_password
+from app.services.manim_renderer import prewarm_render_pool, get_manim_renderer
 
 logger = logging.getLogger(__name__)
 
@@ -81,6 +82,12 @@ async def startup_event():
     print(f"Video Storage: {VIDEO_STORAGE_PATH}")
     print("=" * 60)
     
+    # Boot manim workers (if enabled) before the first render needs them
+    prewarm_render_pool()
+    
+    # Start temp cleanup now so orphaned render dirs are swept even before any render
+    get_manim_renderer().start_cleanup_worker()
+    
     # Seed admin account
     await seed_admin()
 
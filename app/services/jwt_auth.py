@@ -4,8 +4,10 @@ JWT Authentication Service
 Handles token generation and validation for our custom auth system.
 """
 import logging
-from datetime import datetime, timedelta
-from typing import Optional, Dict, Any
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple
 import jwt
 from jwt.exceptions import InvalidTokenError, ExpiredSignatureError
 
@@ -13,6 +15,28 @@ from app.config import JWT_SECRET, JWT_ALGORITHM, JWT_EXPIRATION_HOURS
 
 logger = logging.getLogger(__name__)
 
+# Decoded payloads keyed by raw token, so a bearer token reused across requests
+# is only signature-checked once. Entries hold (valid_until, payload); payload is
+# None for tokens that failed validation, which are remembered only briefly.
+_DECODE_CACHE: "OrderedDict[str, Tuple[float, Optional[Dict[str, Any]]]]" = OrderedDict()
+_DECODE_CACHE_SIZE = 4096
+_INVALID_TOKEN_TTL_SECONDS = 30
+_decode_cache_lock = threading.Lock()
+
+# HMAC key bytes, encoded once instead of on every encode/decode call
+_JWT_SECRET_BYTES = JWT_SECRET.encode('utf-8') if isinstance(JWT_SECRET, str) else JWT_SECRET
+
+# Built once rather than per decode. Our tokens never carry aud/iss/nbf, so only
+# the signature, exp and the claims we read are checked.
+_JWT_ALGOS = [JWT_ALGORITHM]
+_JWT_DECODE_OPTIONS = {
+    "verify_aud": False,
+    "verify_iss": False,
+    "verify_nbf": False,
+    "verify_iat": False,
+    "require": ["exp", "sub", "type"],
+}
+
 
 def create_access_token(user_id: str, email: str, is_waitlist: bool = True) -> str:
     """
@@ -26,8 +50,9 @@ def create_access_token(user_id: str, email: str, is_waitlist: bool = True) -> s
     Returns:
         Encoded JWT token string
     """
-    now = datetime.utcnow()
-    expires = now + timedelta(hours=JWT_EXPIRATION_HOURS)
+    # Integer epoch seconds, which is what PyJWT encodes iat/exp as anyway
+    now = int(time.time())
+    expires = now + JWT_EXPIRATION_HOURS * 3600
     
     payload = {
         'sub': user_id,  # Subject (user ID)
@@ -38,7 +63,7 @@ def create_access_token(user_id: str, email: str, is_waitlist: bool = True) -> s
         'type': 'access'
     }
     
-    token = jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
+    token = jwt.encode(payload, _JWT_SECRET_BYTES, algorithm=JWT_ALGORITHM)
     logger.info(f"Created access token for user: {email}")
     
     return token
@@ -48,21 +73,41 @@ def decode_token(token: str) -> Optional[Dict[str, Any]]:
     """
     Decode and validate a JWT token
     
+    Successful decodes are cached per token until the token's expiry, so
+    repeated requests with the same bearer token skip signature verification.
+    
     Args:
         token: JWT token string
         
     Returns:
         Decoded payload if valid, None otherwise
     """
+    now = time.time()
+    with _decode_cache_lock:
+        entry = _DECODE_CACHE.get(token)
+        if entry is not None and entry[0] > now:
+            _DECODE_CACHE.move_to_end(token)
+            return dict(entry[1]) if entry[1] is not None else None
+    
     try:
-        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        return payload
+        payload = jwt.decode(token, _JWT_SECRET_BYTES, algorithms=_JWT_ALGOS, options=_JWT_DECODE_OPTIONS)
+        valid_until = float(payload['exp']) if 'exp' in payload else now
     except ExpiredSignatureError:
         logger.warning("Token has expired")
-        return None
+        payload = None
+        valid_until = now + _INVALID_TOKEN_TTL_SECONDS
     except InvalidTokenError as e:
         logger.warning(f"Invalid token: {e}")
-        return None
+        payload = None
+        valid_until = now + _INVALID_TOKEN_TTL_SECONDS
+    
+    with _decode_cache_lock:
+        _DECODE_CACHE[token] = (valid_until, payload)
+        _DECODE_CACHE.move_to_end(token)
+        if len(_DECODE_CACHE) > _DECODE_CACHE_SIZE:
+            _DECODE_CACHE.popitem(last=False)
+    
+    return dict(payload) if payload is not None else None
 
 
 def validate_authorization_header(authorization: str) -> Optional[Dict[str, Any]]:
@@ -110,8 +155,8 @@ def create_refresh_token(user_id: str) -> str:
     Returns:
         Encoded JWT refresh token
     """
-    now = datetime.utcnow()
-    expires = now + timedelta(days=30)  # 30 days
+    now = int(time.time())
+    expires = now + 30 * 86400  # 30 days
     
     payload = {
         'sub': user_id,
@@ -120,7 +165,7 @@ def create_refresh_token(user_id: str) -> str:
         'type': 'refresh'
     }
     
-    return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
+    return jwt.encode(payload, _JWT_SECRET_BYTES, algorithm=JWT_ALGORITHM)
 
 
 def validate_refresh_token(token: str) -> Optional[str]:
@@ -1,37 +1,395 @@
 """
 Manim Renderer Service - Executes generated code and produces video
 """
+import os
 import subprocess
-import uuid
+import time
+import secrets
 import asyncio
+import itertools
+import concurrent.futures
+import multiprocessing
 import shutil
 import re
+import struct
 import logging
+from collections import deque
 from pathlib import Path
 from typing import Optional
 from datetime import datetime
-from app.config import TEMP_CODE_PATH, VIDEO_STORAGE_PATH, MANIM_QUALITY, MANIM_TIMEOUT
+from app.config import (
+    TEMP_CODE_PATH, VIDEO_STORAGE_PATH, MANIM_QUALITY, MANIM_TIMEOUT, MANIM_WORKERS, MANIM_CACHE_DIR,
+    MANIM_GPU
+)
 
 # Setup logging
 logger = logging.getLogger(__name__)
 
+# Render IDs: process id + start time, then a per-process counter. Unique across
+# workers and restarts, without the birthday collisions of truncated random hex.
+# They are predictable, so public video filenames add a random token (see render).
+_ID_PREFIX = ""
+_id_counter = itertools.count()
+
+
+def _reset_render_ids():
+    """(Re)seed render IDs for this process; forked children get their own prefix"""
+    global _ID_PREFIX, _id_counter
+    _ID_PREFIX = f"{os.getpid():x}{int(time.time()):x}"
+    _id_counter = itertools.count()
+
+
+_reset_render_ids()
+os.register_at_fork(after_in_child=_reset_render_ids)
+
+# Scene class detection: a class inheriting from *Scene*, else any class named *Scene*
+_SCENE_SUBCLASS_RE = re.compile(r'class\s+(\w+)\s*\([^)]*Scene[^)]*\):')
+_SCENE_NAMED_CLASS_RE = re.compile(r'class\s+(\w*Scene\w*)')
+
+# Output subdirectory manim uses for each quality flag (videos/<module>/<dir>/<Scene>.mp4)
+_QUALITY_DIRS = {
+    "ql": "480p15",
+    "qm": "720p30",
+    "qh": "1080p60",
+    "qp": "1440p60",
+    "qk": "2160p60",
+}
+
+# manim config quality names for each CLI quality flag (used by the worker pool)
+_QUALITY_NAMES = {
+    "ql": "low_quality",
+    "qm": "medium_quality",
+    "qh": "high_quality",
+    "qp": "production_quality",
+    "qk": "fourk_quality",
+}
+
+# Input file name passed to the manim CLI for stdin; its stem names the videos/ subdir
+_STDIN_MODULE_NAME = "-"
+
+# Error text that means the OpenGL renderer couldn't start (no GPU/display/EGL).
+# Kept specific: any scene error under the OpenGL renderer has "opengl" in its traceback.
+_OPENGL_FAILURE_MARKERS = (
+    "cannot create context",
+    "glcontext",
+    "nosuchdisplayexception",
+    "xopendisplay",
+    "libgl.so",
+    "libegl.so",
+)
+
+# Pool of processes with manim already imported (only when MANIM_WORKERS > 0)
+_render_pool: Optional[concurrent.futures.ProcessPoolExecutor] = None
+# PIDs of _render_pool's workers: each reports itself on _render_pid_queue as it
+# starts, and _collect_worker_pids moves them here
+_render_pid_queue = None
+_render_pool_pids: set[int] = set()
+
+
+def _preload_manim():
+    """Pay manim's import cost when a worker starts, not inside a render"""
+    import manim  # noqa: F401
+
+
+def _init_render_worker(pid_queue):
+    """Worker initializer: report this worker's PID, then import manim"""
+    pid_queue.put(os.getpid())
+    _preload_manim()
+
+
+def _render_in_worker(code: str, scene_class: str, media_dir: str, module_name: str,
+                      use_opengl: bool = False):
+    """Render a scene through manim's Python API inside a pool worker"""
+    from manim import tempconfig
+    
+    settings = {
+        "media_dir": media_dir,
+        "input_file": f"{module_name}.py",
+        "quality": _QUALITY_NAMES.get(MANIM_QUALITY, "high_quality"),
+        "format": "mp4",
+        "disable_caching": True,
+    }
+    if use_opengl:
+        settings.update({"renderer": "opengl", "write_to_movie": True})
+    
+    # tempconfig restores the global config afterwards, so renders don't leak settings.
+    # The module runs inside it too: manim picks Cairo/OpenGL mobject classes when
+    # the scene's classes are defined.
+    with tempconfig(settings):
+        namespace = {"__name__": module_name}
+        exec(compile(code, f"{module_name}.py", "exec"), namespace)
+        scene_cls = namespace.get(scene_class)
+        if scene_cls is None:
+            raise Exception(f"Scene class {scene_class} not found in generated code")
+        scene_cls().render()
+
+
+def _is_opengl_failure(message: str) -> bool:
+    """Whether a render error came from setting up OpenGL rather than the scene"""
+    lowered = message.lower()
+    return any(marker in lowered for marker in _OPENGL_FAILURE_MARKERS)
+
+
+def _get_render_pool() -> concurrent.futures.ProcessPoolExecutor:
+    """Get or create the manim worker pool"""
+    global _render_pool, _render_pid_queue
+    if _render_pool is None:
+        # spawn, not fork: the server process has live threads (event loop, to_thread
+        # workers) that a forked child would inherit in an arbitrary state
+        context = multiprocessing.get_context("spawn")
+        _render_pid_queue = context.SimpleQueue()
+        _render_pool_pids.clear()
+        # Generated code runs with exec in the worker and can leave anything behind
+        # (patched manim classes, module globals, open files), so each worker runs
+        # a single render and is then replaced. The replacement imports manim as
+        # soon as it starts, so only back-to-back renders wait for that import.
+        _render_pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers=MANIM_WORKERS,
+            mp_context=context,
+            initializer=_init_render_worker,
+            initargs=(_render_pid_queue,),
+            max_tasks_per_child=1
+        )
+    else:
+        # Drained on every render, as every render starts a new worker
+        _collect_worker_pids()
+    return _render_pool
+
+
+def _collect_worker_pids():
+    """Record PIDs reported by new workers, forgetting workers that have exited"""
+    while not _render_pid_queue.empty():
+        _render_pool_pids.add(_render_pid_queue.get())
+    _render_pool_pids.intersection_update(
+        process.pid for process in multiprocessing.active_children()
+    )
+
+
+def _discard_render_pool(pool: concurrent.futures.ProcessPoolExecutor):
+    """
+    Kill a pool's workers and drop it, so the next render starts a fresh pool.
+    
+    Used when a render times out (a runaway scene would otherwise hold its worker
+    forever) or a worker dies (a broken pool rejects all further work). Other
+    renders still running in the same pool fail as crashed.
+    """
+    global _render_pool
+    if _render_pool is not pool:
+        return  # Already discarded after another render in it failed
+    _render_pool = None
+    _collect_worker_pids()
+    workers = [
+        process for process in multiprocessing.active_children()
+        if process.pid in _render_pool_pids
+    ]
+    pool.shutdown(wait=False, cancel_futures=True)
+    # A worker still starting up hasn't reported yet, but it runs no scene code
+    # and exits on the shutdown sentinel
+    for process in workers:
+        if process.is_alive():
+            process.kill()
+
+# Temp cleanup: up to _CLEANUP_BATCH_SIZE render dirs are deleted per pass, with a
+# pause between passes; dirs older than _STALE_RENDER_DIR_SECONDS are swept as orphans
+_CLEANUP_BATCH_SIZE = 16
+_CLEANUP_PAUSE_SECONDS = 0.5
+_STALE_RENDER_DIR_SECONDS = 3600
+_STALE_SWEEP_INTERVAL_SECONDS = 600
+_MANIM_CACHE_MAX_AGE_SECONDS = 7 * 24 * 3600
+
+# Subdirectories manim writes LaTeX and Pango output to, under the media dir by
+# default; MANIM_CACHE_DIR keeps the same layout
+_TEX_CACHE_SUBDIRS = ("Tex", "texts")
+
+# Lines of manim stdout/stderr kept per render for error reporting
+_OUTPUT_TAIL_LINES = 256
+
+async def _feed_stdin(stdin: asyncio.StreamWriter, data: bytes):
+    """Write data to a subprocess's stdin and close it"""
+    try:
+        stdin.write(data)
+        await stdin.drain()
+    except (BrokenPipeError, ConnectionResetError):
+        pass  # Process exited early; its return code reports why
+    finally:
+        stdin.close()
+
+
+async def _collect_tail(stream: asyncio.StreamReader, tail: deque):
+    """
+    Read a subprocess stream to EOF, keeping only its last lines in tail.
+    
+    Carriage-return redraws (progress bars) collapse to their final state, the
+    way a terminal would show them.
+    """
+    pending = b""
+    while True:
+        chunk = await stream.read(65536)
+        if not chunk:
+            break
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            line = line.rpartition(b"\r")[2]
+            if line.strip():
+                tail.append(line)
+        # Keep an unterminated progress bar from growing without bound
+        pending = pending.rpartition(b"\r")[2]
+    if pending.strip():
+        tail.append(pending)
+
+
+def prewarm_render_pool():
+    """
+    Start all pool workers now (when MANIM_WORKERS > 0) so their manim import
+    happens at service boot rather than inside the first renders.
+    
+    Each warm-up task uses up its worker, but the replacements import manim
+    as they start, still ahead of the first requests.
+    """
+    if MANIM_WORKERS <= 0:
+        return
+    pool = _get_render_pool()
+    for _ in range(MANIM_WORKERS):
+        pool.submit(_preload_manim)
+    logger.info(f"Started {MANIM_WORKERS} manim worker processes")
+
+
+def _read_box_header(f) -> Optional[tuple[bytes, int, int]]:
+    """Read an ISO-BMFF box header at the current offset: (type, header size, box size)"""
+    header = f.read(8)
+    if len(header) < 8:
+        return None
+    size, box_type = struct.unpack('>I4s', header)
+    if size == 1:  # 64-bit size follows the type
+        large = f.read(8)
+        if len(large) < 8:
+            return None
+        return box_type, 16, struct.unpack('>Q', large)[0]
+    return box_type, 8, size
+
+
+def _mp4_duration(video_path: str) -> Optional[float]:
+    """
+    Read the duration from the mp4's moov/mvhd box without spawning ffprobe.
+    
+    Walks top-level boxes by seeking over them (mdat is never read), so this is a
+    handful of small reads whether moov sits before or after the media data.
+    Returns None if the file doesn't look like a well-formed mp4.
+    """
+    try:
+        with open(video_path, 'rb') as f:
+            file_size = f.seek(0, 2)
+            f.seek(0)
+            offset = 0
+            moov_end = None
+            while offset < file_size:
+                box = _read_box_header(f)
+                if box is None:
+                    return None
+                box_type, header_size, box_size = box
+                if box_size == 0:  # box runs to end of file
+                    box_size = file_size - offset
+                if box_size < header_size:
+                    return None
+                if box_type == b'moov':
+                    moov_end = offset + box_size
+                    break
+                offset += box_size
+                f.seek(offset)
+            if moov_end is None:
+                return None
+            
+            # mvhd is a direct child of moov (normally the first one)
+            offset = f.tell()
+            while offset < moov_end:
+                box = _read_box_header(f)
+                if box is None:
+                    return None
+                box_type, header_size, box_size = box
+                if box_size < header_size:
+                    return None
+                if box_type == b'mvhd':
+                    version = f.read(4)[:1]
+                    if version == b'\x01':
+                        body = f.read(28)  # creation(8) modification(8) timescale(4) duration(8)
+                        if len(body) < 28:
+                            return None
+                        timescale, duration = struct.unpack('>IQ', body[16:28])
+                    else:
+                        body = f.read(16)  # creation(4) modification(4) timescale(4) duration(4)
+                        if len(body) < 16:
+                            return None
+                        timescale, duration = struct.unpack('>II', body[8:16])
+                    if not timescale:
+                        return None
+                    return duration / timescale
+                offset += box_size
+                f.seek(offset)
+    except OSError:
+        return None
+    return None
+
+
+def _sendfile_copy(src: str, dst: str):
+    """
+    Copy a file across filesystems in-kernel with sendfile.
+    
+    The source is left in place for the render dir cleanup to remove.
+    """
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+        offset = 0
+        while offset < size:
+            sent = os.sendfile(fdst.fileno(), fsrc.fileno(), offset, size - offset)
+            if sent == 0:
+                break
+            offset += sent
+
 
 class ManimRenderer:
     """Service for rendering Manim animations"""
     
     def __init__(self):
+        # Both directories are created by app.config at import
         self.temp_dir = TEMP_CODE_PATH
         self.output_dir = VIDEO_STORAGE_PATH
+        # Per-render paths are built as plain strings from these
+        self._temp_str = str(self.temp_dir)
+        self._out_str = str(self.output_dir)
+        # Render dirs waiting to be deleted, drained in batches by _cleanup_worker
+        self._cleanup_queue: asyncio.Queue = asyncio.Queue()
+        self._cleanup_task: Optional[asyncio.Task] = None
+        
+        # GPU rendering via manim's OpenGL renderer (MANIM_GPU), until it fails to start
+        self._use_opengl = MANIM_GPU
+        
+        # Shared Tex/Text cache, so repeated equations and labels skip LaTeX/Pango.
+        # Renders get hard links to it and publish new files back (see _seed_tex_cache),
+        # which needs it on the same filesystem as the render dirs
+        for subdir in _TEX_CACHE_SUBDIRS:
+            (MANIM_CACHE_DIR / subdir).mkdir(parents=True, exist_ok=True)
+        self._tex_cache = os.stat(MANIM_CACHE_DIR).st_dev == os.stat(self.temp_dir).st_dev
+        if not self._tex_cache:
+            logger.warning(
+                f"{MANIM_CACHE_DIR} and {self.temp_dir} are on different filesystems; "
+                "the shared Tex/Text cache is disabled"
+            )
         
-        # Ensure directories exist
-        self.temp_dir.mkdir(exist_ok=True)
-        self.output_dir.mkdir(exist_ok=True)
+        # Finished videos are renamed into place when both dirs share a filesystem;
+        # otherwise every render pays for a full copy of the mp4
+        self._same_fs = os.stat(self.temp_dir).st_dev == os.stat(self.output_dir).st_dev
+        if not self._same_fs:
+            logger.warning(
+                f"{self.temp_dir} and {self.output_dir} are on different filesystems; "
+                "videos will be copied instead of renamed"
+            )
     
     def _extract_scene_class_name(self, code: str) -> str:
         """Extract the Scene class name from generated code"""
         
         # Strategy 1: Look for class that inherits from Scene
-        match = re.search(r'class\s+(\w+)\s*\([^)]*Scene[^)]*\):', code)
+        match = _SCENE_SUBCLASS_RE.search(code)
         if match:
             class_name = match.group(1)
             logger.info(f"Found Scene class: {class_name}")
@@ -48,7 +406,7 @@ class ManimRenderer:
             return "SolutionScene"
         
         # Strategy 4: Find any class with Scene in the name
-        match = re.search(r'class\s+(\w*Scene\w*)', code)
+        match = _SCENE_NAMED_CLASS_RE.search(code)
         if match:
             class_name = match.group(1)
             logger.info(f"Found Scene class by name pattern: {class_name}")
@@ -69,44 +427,61 @@ class ManimRenderer:
             dict with video_path, filename, duration, etc.
         """
         # Generate unique identifier
-        file_id = uuid.uuid4().hex[:8]
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        file_id = f"{_ID_PREFIX}{next(_id_counter):x}"
+        timestamp = time.strftime("%Y%m%d_%H%M%S")
         
-        # Create temp code file
-        code_filename = f"scene_{file_id}_{timestamp}.py"
-        code_file = self.temp_dir / code_filename
+        # The code never touches disk: the CLI reads it from stdin and pool workers
+        # get it directly, so this is just the module name manim uses for output dirs
+        module_name = _STDIN_MODULE_NAME if MANIM_WORKERS <= 0 else f"scene_{file_id}"
         
         try:
-            # Write code to file
-            code_file.write_text(code)
-            
             # Extract scene class name dynamically
             scene_class = self._extract_scene_class_name(code)
             logger.info(f"Extracted scene class name: {scene_class}")
             
             # Create output subdirectory for this render
-            render_output_dir = self.temp_dir / f"render_{file_id}"
-            render_output_dir.mkdir(exist_ok=True)
+            render_output_dir = f"{self._temp_str}/render_{file_id}"
+            # (file_id is unique, so a single mkdir with no existence check)
+            try:
+                os.mkdir(render_output_dir)
+            except FileExistsError:
+                pass
+            
+            if self._tex_cache:
+                await asyncio.to_thread(self._seed_tex_cache, render_output_dir)
             
             # Execute manim with dynamic class name
-            result = await self._execute_manim(code_file, render_output_dir, scene_class)
+            if MANIM_WORKERS > 0:
+                await self._execute_in_pool(code, module_name, render_output_dir, scene_class)
+            else:
+                await self._execute_manim(code, render_output_dir, scene_class)
             
             # Find generated video
-            video_path = self._find_generated_video(render_output_dir)
+            video_path = self._find_generated_video(render_output_dir, module_name, scene_class)
             
             if not video_path:
                 raise Exception("Video file not found after rendering")
             
-            # Move video to final location
-            final_filename = f"solution_{file_id}_{timestamp}.mp4"
-            final_path = self.output_dir / final_filename
-            shutil.move(str(video_path), str(final_path))
+            if self._tex_cache:
+                await asyncio.to_thread(self._publish_tex_cache, render_output_dir)
             
-            # Get video info
-            duration = await self._get_video_duration(final_path)
+            # Move video to final location
+            # file_id is sequential, and /videos is served publicly without auth, so the
+            # public name also carries 64 random bits to keep URLs unguessable
+            final_filename = f"solution_{file_id}_{secrets.token_hex(8)}_{timestamp}.mp4"
+            final_path = f"{self._out_str}/{final_filename}"
+            # Get video info from the rendered file, overlapping the copy when there is one
+            if self._same_fs:
+                duration = await self._get_video_duration(video_path)
+                os.replace(video_path, final_path)  # Atomic rename, no data copied
+            else:
+                duration, _ = await asyncio.gather(
+                    self._get_video_duration(video_path),
+                    asyncio.to_thread(_sendfile_copy, video_path, final_path)
+                )
             
             return {
-                "video_path": str(final_path),
+                "video_path": final_path,
                 "filename": final_filename,
                 "video_url": f"/videos/{final_filename}",
                 "duration": duration,
@@ -119,18 +494,21 @@ class ManimRenderer:
         except Exception as e:
             raise Exception(f"Manim rendering failed: {str(e)}")
         finally:
-            # Cleanup temp files
-            self._cleanup_temp_files(code_file, render_output_dir if 'render_output_dir' in locals() else None)
+            # Queue temp files for the background cleanup worker so the response isn't held up by rmtree
+            if 'render_output_dir' in locals():
+                self._cleanup_queue.put_nowait(render_output_dir)
+            self.start_cleanup_worker()
     
-    async def _execute_manim(self, code_file: Path, output_dir: Path, scene_class: str) -> subprocess.CompletedProcess:
-        """Execute manim command"""
+    async def _execute_manim(self, code: str, output_dir: str, scene_class: str) -> subprocess.CompletedProcess:
+        """Execute manim command, feeding the scene code on stdin"""
         cmd = [
             "manim",
             f"-{MANIM_QUALITY}",  # Remove 'p' flag - quality only, no preview
             "--format", "mp4",
             "--disable_caching",  # Disable caching for cleaner execution
-            "--media_dir", str(output_dir),
-            str(code_file),
+            "--media_dir", output_dir,
+            *(["--renderer=opengl", "--write_to_movie"] if self._use_opengl else []),
+            "-",  # Read the scene module from stdin instead of a temp .py file
             scene_class  # Dynamic class name
         ]
         
@@ -139,18 +517,32 @@ class ManimRenderer:
         # Run manim asynchronously
         process = await asyncio.create_subprocess_exec(
             *cmd,
+            stdin=asyncio.subprocess.PIPE,
             stdout=asyncio.subprocess.PIPE,
             stderr=asyncio.subprocess.PIPE
         )
         
+        # Output is consumed as it arrives, keeping only a bounded tail of each stream
+        # (manim's progress bars alone can run to hundreds of KB per render)
+        stdout_tail: deque[bytes] = deque(maxlen=_OUTPUT_TAIL_LINES)
+        stderr_tail: deque[bytes] = deque(maxlen=_OUTPUT_TAIL_LINES)
+        
         try:
-            stdout, stderr = await asyncio.wait_for(
-                process.communicate(),
+            await asyncio.wait_for(
+                asyncio.gather(
+                    _feed_stdin(process.stdin, code.encode('utf-8')),
+                    _collect_tail(process.stdout, stdout_tail),
+                    _collect_tail(process.stderr, stderr_tail),
+                    process.wait()
+                ),
                 timeout=MANIM_TIMEOUT
             )
             
             if process.returncode != 0:
-                error_msg = stderr.decode('utf-8') if stderr else "Unknown error"
+                error_msg = b"\n".join(stderr_tail).decode('utf-8', 'replace') or "Unknown error"
+                if self._use_opengl and _is_opengl_failure(error_msg):
+                    self._disable_opengl(error_msg)
+                    return await self._execute_manim(code, output_dir, scene_class)
                 raise Exception(f"Manim command failed: {error_msg}")
             
             return process
@@ -159,26 +551,88 @@ class ManimRenderer:
             process.kill()
             raise subprocess.TimeoutExpired(cmd, MANIM_TIMEOUT)
     
-    def _find_generated_video(self, output_dir: Path) -> Optional[Path]:
+    async def _execute_in_pool(self, code: str, module_name: str, output_dir: str, scene_class: str):
+        """
+        Render in a warm worker process, skipping interpreter startup and manim imports.
+        
+        A pool worker can't be killed on its own, so on timeout the whole pool is
+        torn down and rebuilt on the next render.
+        """
+        logger.info(f"Rendering in worker pool with class: {scene_class}")
+        
+        loop = asyncio.get_running_loop()
+        pool = _get_render_pool()
+        future = loop.run_in_executor(
+            pool, _render_in_worker,
+            code, scene_class, output_dir, module_name, self._use_opengl
+        )
+        try:
+            await asyncio.wait_for(future, timeout=MANIM_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning("Pooled render timed out - restarting manim workers")
+            _discard_render_pool(pool)
+            raise subprocess.TimeoutExpired(["manim", scene_class], MANIM_TIMEOUT)
+        except concurrent.futures.process.BrokenProcessPool as e:
+            _discard_render_pool(pool)
+            raise Exception(f"Manim worker crashed: {str(e)}")
+        except Exception as e:
+            if self._use_opengl and _is_opengl_failure(str(e)):
+                self._disable_opengl(str(e))
+                return await self._execute_in_pool(code, module_name, output_dir, scene_class)
+            raise
+    
+    def _disable_opengl(self, error_msg: str):
+        """Switch this renderer to Cairo after the OpenGL renderer failed to start"""
+        self._use_opengl = False
+        logger.warning(f"OpenGL renderer unavailable, falling back to Cairo: {error_msg[-500:]}")
+    
+    def _find_generated_video(self, output_dir: str, module_name: Optional[str] = None,
+                              scene_class: Optional[str] = None) -> Optional[str]:
         """Find the generated MP4 video in output directory"""
-        # Manim creates videos in media/videos/scene_*/quality/
-        video_files = list(output_dir.rglob("*.mp4"))
+        # Manim creates videos in media/videos/scene_*/quality/ - try the exact path first
+        quality_dir = _QUALITY_DIRS.get(MANIM_QUALITY)
+        if module_name and scene_class and quality_dir:
+            expected = f"{output_dir}/videos/{module_name}/{quality_dir}/{scene_class}.mp4"
+            if os.path.isfile(expected):
+                return expected
         
-        if not video_files:
-            return None
+        # Otherwise walk the tree with scandir, whose entries carry their own stat info
+        newest_mtime = -1
+        newest_path = None
+        stack = [output_dir]
+        while stack:
+            try:
+                with os.scandir(stack.pop()) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.name.endswith('.mp4'):
+                            mtime = entry.stat().st_mtime_ns
+                            if mtime > newest_mtime:
+                                newest_mtime = mtime
+                                newest_path = entry.path
+            except OSError:
+                continue
         
         # Return the most recent video file
-        return max(video_files, key=lambda p: p.stat().st_mtime)
+        return newest_path
+    
+    async def _get_video_duration(self, video_path: str) -> float:
+        """Get video duration from the mp4 header, falling back to ffprobe"""
+        duration = _mp4_duration(video_path)
+        if duration is None:
+            duration = await self._ffprobe_duration(video_path)
+        return duration if duration is not None else 0.0
     
-    async def _get_video_duration(self, video_path: Path) -> float:
-        """Get video duration using ffprobe"""
+    async def _ffprobe_duration(self, video_path: str) -> Optional[float]:
+        """Get video duration using ffprobe (None if it can't be determined)"""
         try:
             cmd = [
                 "ffprobe",
                 "-v", "error",
                 "-show_entries", "format=duration",
-                "-of", "default=noprint_wrappers=1:nokey=1",
-                str(video_path)
+                "-of", "csv=p=0",
+                video_path
             ]
             
             process = await asyncio.create_subprocess_exec(
@@ -190,21 +644,140 @@ class ManimRenderer:
             stdout, _ = await process.communicate()
             duration_str = stdout.decode('utf-8').strip()
             
-            return float(duration_str) if duration_str else 0.0
+            return float(duration_str) if duration_str else None
             
         except Exception:
-            return 0.0
+            return None
     
-    def _cleanup_temp_files(self, code_file: Optional[Path], render_dir: Optional[Path]):
-        """Clean up temporary files"""
-        try:
-            if code_file and code_file.exists():
-                code_file.unlink()
+    def _seed_tex_cache(self, render_dir: str):
+        """
+        Hard-link the shared Tex/Text cache into a render's own Tex/ and texts/.
+        
+        manim checks for an existing output file and otherwise writes it in place,
+        so a directory shared by concurrent renders could hand one render another's
+        half-written .tex/.dvi/.svg. Each render writes only to its own dirs and
+        reads cached files through links, which manim never modifies.
+        """
+        for subdir in _TEX_CACHE_SUBDIRS:
+            target = f"{render_dir}/{subdir}"
+            os.makedirs(target, exist_ok=True)
+            try:
+                with os.scandir(MANIM_CACHE_DIR / subdir) as it:
+                    for entry in it:
+                        try:
+                            os.link(entry.path, f"{target}/{entry.name}")
+                        except OSError:
+                            pass  # Pruned meanwhile; manim regenerates it
+            except OSError:
+                continue
+    
+    def _publish_tex_cache(self, render_dir: str):
+        """
+        Add Tex/Text files created by a finished render to the shared cache.
+        
+        Seeded files are links (st_nlink > 1), so only new ones are published. A
+        link appears atomically and these files are complete, so readers never see
+        a partial file; if another render published the same name first, keep it.
+        """
+        published = 0
+        for subdir in _TEX_CACHE_SUBDIRS:
+            cache_dir = MANIM_CACHE_DIR / subdir
+            try:
+                with os.scandir(f"{render_dir}/{subdir}") as it:
+                    for entry in it:
+                        if not entry.is_file(follow_symlinks=False):
+                            continue
+                        if entry.stat(follow_symlinks=False).st_nlink > 1:
+                            continue
+                        try:
+                            os.link(entry.path, cache_dir / entry.name)
+                            published += 1
+                        except OSError:
+                            pass  # Already published by a concurrent render
+            except OSError:
+                continue
+        if published:
+            logger.info(f"Added {published} files to the manim Tex/Text cache")
+    
+    def start_cleanup_worker(self):
+        """Start the cleanup worker on the running loop if it isn't already running"""
+        if self._cleanup_task is None or self._cleanup_task.done():
+            self._cleanup_task = asyncio.create_task(self._cleanup_worker())
+    
+    async def _cleanup_worker(self):
+        """Delete queued render dirs in batches, and periodically sweep orphaned ones"""
+        last_sweep = 0.0
+        while True:
+            if time.monotonic() - last_sweep >= _STALE_SWEEP_INTERVAL_SECONDS:
+                await asyncio.to_thread(self._sweep_stale_render_dirs)
+                await asyncio.to_thread(self._sweep_manim_cache)
+                last_sweep = time.monotonic()
+            
+            # Wake up for the next sweep even if no render queues anything meanwhile.
+            # (asyncio.timeout, not wait_for: on 3.11 wait_for can swallow the shutdown
+            # cancellation when an item arrives at the same time, hanging the loop close)
+            next_sweep_in = _STALE_SWEEP_INTERVAL_SECONDS - (time.monotonic() - last_sweep)
+            try:
+                async with asyncio.timeout(max(next_sweep_in, 0)):
+                    first = await self._cleanup_queue.get()
+            except TimeoutError:
+                continue
             
-            if render_dir and render_dir.exists():
+            batch = [first]
+            while len(batch) < _CLEANUP_BATCH_SIZE and not self._cleanup_queue.empty():
+                batch.append(self._cleanup_queue.get_nowait())
+            await asyncio.to_thread(self._cleanup_temp_files, batch)
+            
+            await asyncio.sleep(_CLEANUP_PAUSE_SECONDS)
+    
+    def _cleanup_temp_files(self, render_dirs: list[str]):
+        """Clean up temporary files"""
+        for render_dir in render_dirs:
+            try:
                 shutil.rmtree(render_dir, ignore_errors=True)
-        except Exception:
-            pass  # Best effort cleanup
+            except Exception:
+                pass  # Best effort cleanup
+    
+    def _sweep_manim_cache(self):
+        """Prune Tex/Text cache files that haven't been written for a week"""
+        cutoff = time.time() - _MANIM_CACHE_MAX_AGE_SECONDS
+        removed = 0
+        stack = [str(MANIM_CACHE_DIR / subdir) for subdir in _TEX_CACHE_SUBDIRS]
+        while stack:
+            try:
+                with os.scandir(stack.pop()) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.stat(follow_symlinks=False).st_mtime < cutoff:
+                            try:
+                                os.unlink(entry.path)
+                                removed += 1
+                            except OSError:
+                                pass
+            except OSError:
+                continue
+        if removed:
+            logger.info(f"Pruned {removed} old manim cache files")
+    
+    def _sweep_stale_render_dirs(self):
+        """Remove render dirs left behind by crashes or restarts"""
+        cutoff = time.time() - _STALE_RENDER_DIR_SECONDS
+        try:
+            with os.scandir(self.temp_dir) as it:
+                stale = [
+                    entry.path for entry in it
+                    if entry.name.startswith("render_")
+                    and entry.is_dir(follow_symlinks=False)
+                    and entry.stat(follow_symlinks=False).st_mtime < cutoff
+                ]
+        except OSError:
+            return
+        
+        if stale:
+            logger.info(f"Removing {len(stale)} stale render directories")
+        for path in stale:
+            shutil.rmtree(path, ignore_errors=True)
 
 
 # Singleton instance
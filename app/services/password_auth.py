@@ -4,11 +4,34 @@ Password Authentication Service
 Handles password hashing and verification using bcrypt.
 Used for admin and custom user credentials.
 """
+import asyncio
 import bcrypt
+import hashlib
+import hmac
 import logging
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Union
+
+from app.config import BCRYPT_ROUNDS
 
 logger = logging.getLogger(__name__)
 
+# Recent successful verifications, so repeated logins with the same credentials
+# skip bcrypt for a short while. Keys are HMACs under a per-process random key,
+# so neither passwords nor anything derived offline from them is kept in memory.
+# Failures are never cached: every wrong guess pays the full bcrypt cost.
+_VERIFY_CACHE: "OrderedDict[bytes, float]" = OrderedDict()
+_VERIFY_CACHE_SIZE = 1024
+_VERIFY_CACHE_TTL_SECONDS = 60
+_VERIFY_CACHE_KEY = secrets.token_bytes(32)
+_verify_cache_lock = threading.Lock()
+
+# Length of every bcrypt hash: "$2b$" + 2-digit cost + "$" + 53 chars of salt and digest
+_BCRYPT_HASH_LENGTH = 60
+
 
 def hash_password(password: str) -> str:
     """
@@ -21,27 +44,78 @@ def hash_password(password: str) -> str:
         Hashed password string
     """
     # Generate salt and hash
-    salt = bcrypt.gensalt(rounds=12)
+    salt = bcrypt.gensalt(rounds=BCRYPT_ROUNDS)
     hashed = bcrypt.hashpw(password.encode('utf-8'), salt)
     return hashed.decode('utf-8')
 
 
-def verify_password(password: str, hashed: str) -> bool:
+def verify_password(password: str, hashed: Union[str, bytes]) -> bool:
     """
     Verify a password against its hash
     
+    Successful checks are remembered for a minute (see _VERIFY_CACHE).
+    
     Args:
         password: Plain text password to verify
-        hashed: Stored hashed password
+        hashed: Stored hashed password (str as stored in Firestore, or bytes)
         
     Returns:
         True if password matches, False otherwise
     """
     try:
-        return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+        password_bytes = password.encode('utf-8')
+        hashed_bytes = hashed if isinstance(hashed, bytes) else hashed.encode('utf-8')
+    except Exception as e:
+        logger.error(f"Password verification error: {e}")
+        return False
+    
+    # Anything that isn't a 60-byte $2x$ bcrypt hash can't match; reject it before
+    # hashing the password or touching bcrypt
+    if len(hashed_bytes) != _BCRYPT_HASH_LENGTH or not hashed_bytes.startswith(b'$2'):
+        logger.error("Password verification error: stored hash is not a bcrypt hash")
+        return False
+    
+    key = hmac.new(
+        _VERIFY_CACHE_KEY,
+        hashlib.sha256(password_bytes).digest() + hashed_bytes,
+        hashlib.sha256
+    ).digest()
+    now = time.monotonic()
+    with _verify_cache_lock:
+        expires = _VERIFY_CACHE.get(key)
+        if expires is not None and expires > now:
+            return True
+    
+    try:
+        valid = bcrypt.checkpw(password_bytes, hashed_bytes)
     except Exception as e:
         logger.error(f"Password verification error: {e}")
         return False
+    
+    if valid:
+        with _verify_cache_lock:
+            _VERIFY_CACHE[key] = now + _VERIFY_CACHE_TTL_SECONDS
+            _VERIFY_CACHE.move_to_end(key)
+            if len(_VERIFY_CACHE) > _VERIFY_CACHE_SIZE:
+                _VERIFY_CACHE.popitem(last=False)
+    return valid
+
+
+async def verify_password_async(password: str, hashed: Union[str, bytes]) -> bool:
+    """
+    Verify a password without blocking the event loop
+    
+    bcrypt is ~250ms of CPU at the default cost, so it runs in a worker thread
+    (bcrypt releases the GIL while hashing).
+    
+    Args:
+        password: Plain text password to verify
+        hashed: Stored hashed password
+        
+    Returns:
+        True if password matches, False otherwise
+    """
+    return await asyncio.to_thread(verify_password, password, hashed)
 
 
 def is_strong_password(password: str) -> tuple[bool, str]:
@@ -61,13 +135,27 @@ def is_strong_password(password: str) -> tuple[bool, str]:
     if len(password) < 8:
         return False, "Password must be at least 8 characters"
     
-    if not any(c.islower() for c in password):
+    # One pass over the password, stopping as soon as all three classes are seen
+    has_lower = has_upper = has_digit = False
+    for c in password:
+        if c.islower():
+            has_lower = True
+        elif c.isupper():
+            has_upper = True
+        elif c.isdigit():
+            has_digit = True
+        else:
+            continue
+        if has_lower and has_upper and has_digit:
+            break
+    
+    if not has_lower:
         return False, "Password must include a lowercase letter"
     
-    if not any(c.isupper() for c in password):
+    if not has_upper:
         return False, "Password must include an uppercase letter"
     
-    if not any(c.isdigit() for c in password):
+    if not has_digit:
         return False, "Password must include a number"
     
     return True, ""
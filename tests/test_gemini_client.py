@@ -0,0 +1,127 @@
+"""
+Regression tests for the GeminiClient code-generation pipeline
+"""
+import asyncio
+import io
+import os
+from types import SimpleNamespace
+
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+
+from PIL import Image
+
+from app.services.gemini_client import GeminiClient
+
+
+# Valid scene whose string literals contain unpaired brackets: a character count
+# sees 7 ')' against 6 '(' even though the code parses.
+BRACKETS_IN_STRINGS_SCENE = '''from manim import *
+
+class SolutionScene(Scene):
+    def construct(self):
+        interval = MathTex(r"x \\in [0, 1)")
+        label = Text("f(x")
+        self.play(Write(interval))
+        self.play(FadeIn(label))
+        self.wait(1)
+'''
+
+
+class _FakeModel:
+    model_name = "fake"
+    
+    def __init__(self, text: str):
+        self._text = text
+    
+    def generate_content(self, _parts):
+        return SimpleNamespace(parts=[SimpleNamespace(text=self._text)], text=self._text)
+
+
+def _png_bytes() -> bytes:
+    buf = io.BytesIO()
+    Image.new("RGB", (4, 4)).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def _client_returning(text: str) -> GeminiClient:
+    client = GeminiClient.__new__(GeminiClient)
+    client.model = _FakeModel(text)
+    return client
+
+
+def test_brackets_inside_strings_are_not_reported_incomplete():
+    client = _client_returning(f"```python\n{BRACKETS_IN_STRINGS_SCENE}```")
+    
+    code = asyncio.run(client.generate_manim_code(_png_bytes(), "Plot the interval"))
+    
+    assert 'MathTex(r"x \\in [0, 1)")' in code
+    assert client._check_syntax(code)[0]
+
+
+def test_truncated_code_is_still_reported_incomplete():
+    truncated = BRACKETS_IN_STRINGS_SCENE.replace("self.wait(1)\n", "self.play(Write(MathTex(r\"y\"")
+    client = _client_returning(f"```python\n{truncated}```")
+    
+    try:
+        asyncio.run(client.generate_manim_code(_png_bytes(), "Plot the interval"))
+    except Exception as e:
+        assert "incomplete" in str(e) or "syntax errors" in str(e)
+    else:
+        raise AssertionError("truncated code was accepted")
+
+
+def _fix(code: str) -> str:
+    return GeminiClient.__new__(GeminiClient)._fix_common_issues(code)
+
+
+def test_num_dashes_is_not_stripped():
+    code = _fix("line = DashedVMobject(circle, num_dashes=30)\n")
+    
+    assert "DashedVMobject(circle, num_dashes=30)" in code
+
+
+def test_hallucinated_dash_params_are_stripped():
+    code = _fix("line = DashedLine(a, b, dash_length=0.1, dashes=[2, 1])\n")
+    
+    assert "DashedLine(a, b)" in code
+
+
+def test_latex_in_title_is_made_raw():
+    code = _fix('title = Title("Find \\alpha")\nlabel = Text(\'angle \\theta here\')\n')
+    
+    assert 'Title(r"Find \\alpha")' in code
+    assert "Text(r'angle \\theta here')" in code
+
+
+def test_escaped_latex_in_title_is_left_alone():
+    source = 'title = Title("Find \\\\alpha")\nlabel = Text("angle \\\\theta here")\n'
+    
+    code = _fix(source)
+    
+    assert 'Title("Find \\\\alpha")' in code
+    assert 'Text("angle \\\\theta here")' in code
+
+
+def test_create_of_spring_like_variable_ignores_case():
+    code = _fix("self.play(Create(SPRING))\nself.play(Create(my_PARAMETRIC_curve))\n")
+    
+    assert "FadeIn(SPRING)" in code
+    assert "FadeIn(my_PARAMETRIC_curve)" in code
+
+
+def test_path_arc_arrow_feeds_curved_arrow_fix():
+    code = _fix(
+        "a = Arrow(LEFT, RIGHT, path_arc=PI/2)\n"
+        "b = Arrow(start=UP, end=DOWN, path_arc=PI/4)\n"
+    )
+    
+    assert "CurvedArrow(start_point=LEFT, end_point=RIGHT, angle=PI/2)" in code
+    assert "CurvedArrow(start_point=UP, end_point=DOWN, angle=PI/4)" in code
+    
+    code = _fix(
+        "a = Arrow(LEFT, RIGHT, path_arc=PI/3)\n"
+        "b = CurvedArrow(start=UP, end=DOWN)\n"
+    )
+    
+    assert "CurvedArrow(start_point=LEFT, end_point=RIGHT, angle=PI/3)" in code
+    assert "CurvedArrow(start_point=UP, end_point=DOWN)" in code